@@ -37,6 +37,7 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 
 import urllib
+
 import numpy as np
 
 from flask import Flask, Response, jsonify, request
@@ -46,7 +47,30 @@ import opendap_protocol as dap
 app = Flask(__name__)
 
 
+def _readonly(arr):
+    arr.setflags(write=False)
+    return arr
+
+
+# Coordinate and data arrays shared by the test cases
+_X = _readonly(np.array([0, 1]))
+_Y = _readonly(np.array([10, 11]))
+_Z = _readonly(np.array([20, 21]))
+_P_2D = _readonly(np.array([[0, 0], [0, 0]]))
+_P_3D = _readonly(np.array([[[0, 0], [0, 0]], [[1, 1], [1, 1]]]))
+
+
 class BaseDataset(object):
+    _dataset = None
+
+    @property
+    def dataset(self):
+        # The data set is built by the subclasses on first use and reused
+        # afterwards
+        if self._dataset is None:
+            self._dataset = self._make_dataset()
+        return self._dataset
+
     def dds(self, constraint=''):
         return self.dataset.dds(constraint=constraint)
 
@@ -62,16 +86,15 @@ class BaseDataset(object):
 
 
 class Test2DGrid(BaseDataset):
-    @property
-    def dataset(self):
+    def _make_dataset(self):
         dataset = dap.Dataset(name='test')
 
-        x = dap.Array(name='x', data=np.array([0, 1]), dtype=dap.Int16)
-        y = dap.Array(name='y', data=np.array([10, 11]), dtype=dap.Int16)
+        x = dap.Array(name='x', data=_X, dtype=dap.Int16)
+        y = dap.Array(name='y', data=_Y, dtype=dap.Int16)
 
         p = dap.Grid(
             name='p',
-            data=np.array([[0, 0], [0, 0]]),
+            data=_P_2D,
             dtype=dap.Int32,
             dimensions=[x, y])
 
@@ -98,17 +121,16 @@ class Test2DGrid(BaseDataset):
 
 
 class Test3DGrid(BaseDataset):
-    @property
-    def dataset(self):
+    def _make_dataset(self):
         dataset = dap.Dataset(name='test')
 
-        x = dap.Array(name='x', data=np.array([0, 1]), dtype=dap.Int16)
-        y = dap.Array(name='y', data=np.array([10, 11]), dtype=dap.Int16)
-        z = dap.Array(name='z', data=np.array([20, 21]), dtype=dap.Int16)
+        x = dap.Array(name='x', data=_X, dtype=dap.Int16)
+        y = dap.Array(name='y', data=_Y, dtype=dap.Int16)
+        z = dap.Array(name='z', data=_Z, dtype=dap.Int16)
 
         p = dap.Grid(
             name='p',
-            data=np.array([[[0, 0], [0, 0]], [[1, 1], [1, 1]]]),
+            data=_P_3D,
             dtype=dap.Int32,
             dimensions=[x, y, z])
 
@@ -123,16 +145,22 @@ class Test3DGrid(BaseDataset):
         return dataset
 
 
+# Test cases are looked up on every request, so instantiate them only once and
+# reuse their data sets. Rendering never modifies a data set, so they can be
+# shared by the threads of the server.
+_DATASETS = {name: sc() for name, sc in BaseDataset.subclasses().items()}
+
+
 @app.route('/', methods=['GET'])
 def index():
-    return jsonify([k for k, v in BaseDataset.subclasses().items()])
+    return jsonify([k for k, v in _DATASETS.items()])
 
 
 @app.route('/<testcase>.dds', methods=['GET'])
 def dds(testcase):
     constraint = urllib.parse.urlsplit(request.url)[3]
     return Response(
-        BaseDataset.subclasses()[testcase]().dds(constraint=constraint),
+        _DATASETS[testcase].dds(constraint=constraint),
         mimetype='text/plain')
 
 
@@ -140,7 +168,7 @@ def dds(testcase):
 def das(testcase):
     constraint = urllib.parse.urlsplit(request.url)[3]
     return Response(
-        BaseDataset.subclasses()[testcase]().das(constraint=constraint),
+        _DATASETS[testcase].das(constraint=constraint),
         mimetype='text/plain')
 
 
@@ -148,7 +176,7 @@ def das(testcase):
 def dods(testcase):
     constraint = urllib.parse.urlsplit(request.url)[3]
     return Response(
-        BaseDataset.subclasses()[testcase]().dods(constraint=constraint),
+        _DATASETS[testcase].dods(constraint=constraint),
         mimetype='application/octet-stream')
 
 
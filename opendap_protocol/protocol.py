@@ -40,19 +40,39 @@ This library only implements the server side encoding. It is tested to serve
 clients using the netCDF4 library. PyDAP client libraries are not supported.
 """
 
+import itertools
+import operator
 import re
+import struct
+import weakref
 from dataclasses import dataclass
+from functools import lru_cache
 
+import dask
 import dask.array as da
 import numpy as np
 
 INDENT = '    '
 SLICE_CONSTRAINT_RE = r'\[([\d,\W]+)\]$'
 
+_SLICE_RE = re.compile(SLICE_CONSTRAINT_RE)
+
+# Precompiled structs for encoding atomic values
+_ATOM_STRUCTS = {
+    '>i4': struct.Struct('>i'),
+    '>u4': struct.Struct('>I'),
+    '>f4': struct.Struct('>f'),
+    '>f8': struct.Struct('>d'),
+    'B': struct.Struct('B'),
+}
+
 
 @dataclass
 class Config:
-    DASK_ENCODE_CHUNK_SIZE: int = 20e6
+    DASK_ENCODE_CHUNK_SIZE: int = 20_000_000
+    DASK_ENCODE_PREFETCH: int = 2
+    NUMPY_ENCODE_CHUNK_SIZE: int = 20_000_000
+    RESPONSE_CACHE_SIZE: int = 128
 
 
 class DAPError(Exception):
@@ -63,12 +83,13 @@ class DAPObject:
     """A generic DAP object class.
     """
     def __init__(self, name='', parent=None, *args, **kwargs):
-        try:
-            self.name = '_'.join(name.split(' '))
-        except AttributeError:
-            self.name = name
+        if isinstance(name, str):
+            name = name.replace(' ', '_')
+        self._name = name
 
         self.children = []
+        self._parent = None
+        self._reset_cache()
         self.parent = parent
 
         self.data = None
@@ -78,81 +99,160 @@ class DAPObject:
     def dds(self, constraint=''):
         if meets_constraint(constraint, self.data_path):
             yield self.ddshead()
-            for obj in self.children:
-                obj.parent = self
-                for stmt in obj.dds(constraint=constraint):
-                    yield stmt
+            if constraint:
+                for obj in self.children:
+                    yield from obj.dds(constraint=constraint)
+            else:
+                # The unconstrained output of the children only changes if
+                # the hierarchy is modified
+                if self._children_dds is None:
+                    self._children_dds = [
+                        ''.join(obj.dds()) for obj in self.children
+                    ]
+                yield from self._children_dds
             yield self.ddstail()
         return
 
     def das(self, constraint=''):
         if meets_constraint(constraint, self.data_path):
             yield self.dashead()
-            for obj in self.children:
-                obj.parent = self
-                for stmt in obj.das(constraint=constraint):
-                    yield stmt
+            if constraint:
+                for obj in self.children:
+                    yield from obj.das(constraint=constraint)
+            else:
+                if self._children_das is None:
+                    self._children_das = [
+                        ''.join(obj.das()) for obj in self.children
+                    ]
+                yield from self._children_das
             yield self.dastail()
         return
 
     def dods(self, constraint=''):
         if meets_constraint(constraint, self.data_path):
-            for stmt in self.dds(constraint=constraint):
-                yield stmt.encode()
-
-        yield b'\n'
+            # Send the whole DDS header in one piece instead of line by line
+            yield ''.join(self.dds(constraint=constraint)).encode() + b'\n'
 
-        if meets_constraint(constraint, self.data_path):
-            for stmt in self.dods_data(constraint=constraint):
-                yield stmt
+            yield from self.dods_data(constraint=constraint)
+        else:
+            yield b'\n'
         return
 
+    def dods_bytes(self, constraint=''):
+        """Return the complete DODS response as a single bytes object.
+
+        Use this instead of :meth:`dods` if the response does not need to be
+        streamed.
+        """
+        return b''.join(self.dods(constraint=constraint))
+
     def dods_data(self, constraint=''):
 
         if meets_constraint(constraint, self.data_path):
             for obj in self.children:
-                for stmt in obj.dods_data(constraint=constraint):
-                    yield stmt
+                yield from obj.dods_data(constraint=constraint)
         return
 
     def append(self, *obj):
         for o in obj:
             o.parent = self
             self.children.append(o)
+        self._children_changed()
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, name):
+        self._name = name
+        self._output_changed()
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @parent.setter
+    def parent(self, parent):
+        if parent is not self._parent:
+            self._parent = parent
+            self._reset_cache()
+
+    def _reset_cache(self):
+        """Reset all cached values that depend on the position of the object
+        within the data hierarchy.
+        """
+        self._data_path = None
+        self._indent = None
+        self._ddshead = None
+        self._ddstail = None
+        self._dashead = None
+        self._dastail = None
+        self._reset_children_cache()
+        for obj in self.children:
+            obj._reset_cache()
+
+    def _output_changed(self):
+        """Drop all cached output that depends on a property of this object.
+        """
+        self._reset_cache()
+        self._children_changed()
+
+    def _children_changed(self):
+        """Drop the cached output of the children of this object and of all
+        its ancestors.
+        """
+        obj = self
+        while obj is not None:
+            obj._reset_children_cache()
+            obj = obj.parent
+
+    def _reset_children_cache(self):
+        self._children_dds = None
+        self._children_das = None
 
     @property
     def indent(self):
-        if self.__class__.__name__ == 'Dataset':
-            return ''
-        else:
-            return self.parent.indent + INDENT
+        if self._indent is None:
+            if isinstance(self, Dataset):
+                self._indent = ''
+            else:
+                self._indent = self.parent.indent + INDENT
+        return self._indent
 
     @property
     def data_path(self):
-        if self.__class__.__name__ == 'Dataset':
-            return ''
-        else:
-            if self.parent.__class__.__name__ == 'Dataset':
-                return self.name
+        if self._data_path is None:
+            if isinstance(self, Dataset):
+                self._data_path = ''
+            elif isinstance(self.parent, Dataset):
+                self._data_path = self.name
             else:
-                return '.'.join([self.parent.data_path, self.name])
+                self._data_path = '.'.join([self.parent.data_path, self.name])
+        return self._data_path
 
     def ddshead(self):
-        return '{indent}{obj} {{\n'.format(indent=self.indent,
-                                           obj=self.__class__.__name__)
+        if self._ddshead is None:
+            self._ddshead = f'{self.indent}{self.__class__.__name__} {{\n'
+        return self._ddshead
 
     def ddstail(self):
-        return '{indent}}} {name};\n'.format(indent=self.indent,
-                                             name=self.name)
+        if self._ddstail is None:
+            self._ddstail = f'{self.indent}}} {self.name};\n'
+        return self._ddstail
 
     def dashead(self):
-        name = self.name
-        if isinstance(self, Dataset):
-            name = 'Attributes'
-        return '{indent}{name} {{\n'.format(indent=self.indent, name=name)
+        if self._dashead is None:
+            name = self.name
+            if isinstance(self, Dataset):
+                name = 'Attributes'
+            self._dashead = f'{self.indent}{name} {{\n'
+        return self._dashead
 
     def dastail(self):
-        return '{indent}}}\n'.format(indent=self.indent)
+        if self._dastail is None:
+            self._dastail = f'{self.indent}}}\n'
+        return self._dastail
 
     def _parse_args(self, args, kwargs):
         pass
@@ -190,29 +290,21 @@ class DAPAtom(DAPObject):
 
         :param nptype: A :class:`numpy.dtpye` object
 
-        :returns: A subclass of :class:`DAPAtom`
+        :returns: A subclass of :class:`DAPAtom`, or None for unsupported types
         """
-        # Handle special cases first
-        if nptype == np.int8:
-            return Int16
-        elif nptype == np.uint8:
-            return Byte
-        elif nptype == np.int64:
-            return Int32
-        elif nptype == np.uint64:
-            return UInt32
-        else:
-            # then handle the rest
-            for subclass in cls.subclasses():
-                if subclass.dtype == nptype:
-                    return subclass
+        # np.dtype(None) would be float64
+        if nptype is None:
+            return None
+        try:
+            return _NP_TO_DAP.get(np.dtype(nptype))
+        except (TypeError, ValueError):
+            return None
 
     def das(self, constraint=''):
         if meets_constraint(constraint, self.data_path):
             yield self.dashead()
             for obj in self.children:
-                for stmt in obj.das(constraint=constraint):
-                    yield stmt
+                yield from obj.das(constraint=constraint)
             yield self.dastail()
 
     def dds(self, constraint=''):
@@ -265,9 +357,19 @@ class String(DAPAtom):
     dtype = np.str_
     str = 'S'
 
+    def __init__(self, value=None, name=None, parent=None):
+        super(String, self).__init__(value=value, name=name, parent=parent)
+        # Encoded on first use, such that DDS and DAS work for any value
+        self._val_encoded = None
+
     def dods_data(self, constraint=''):
         if meets_constraint(constraint, self.data_path):
-            yield from dods_encode(self._val.encode('ascii'), self)
+            if self._val_encoded is None:
+                if isinstance(self._val, str):
+                    self._val_encoded = self._val.encode('ascii')
+                else:
+                    self._val_encoded = self._val
+            yield from dods_encode(self._val_encoded, self)
 
 
 class URL(String):
@@ -275,6 +377,16 @@ class URL(String):
     str = 'S'
 
 
+_NP_TO_DAP = {np.dtype(sc.dtype): sc for sc in DAPAtom.subclasses()}
+# Types without a direct DAP equivalent
+_NP_TO_DAP.update({
+    np.dtype(np.int8): Int16,
+    np.dtype(np.uint8): Byte,
+    np.dtype(np.int64): Int32,
+    np.dtype(np.uint64): UInt32,
+})
+
+
 class Structure(DAPObject):
     """Class representing a DAP structure.
     """
@@ -284,13 +396,46 @@ class Structure(DAPObject):
 class Dataset(Structure):
     """Class representing a DAP dataset.
     """
+    def dds(self, constraint=''):
+        yield self._cached_response('dds', constraint)
+
+    def das(self, constraint=''):
+        yield self._cached_response('das', constraint)
+
+    def _cached_response(self, response, constraint):
+        """Return a complete DDS or DAS response, rendering it only once per
+        constraint.
+
+        :param response: (string) Either 'dds' or 'das'
+        :param constraint: (string) A DAP constraint string
+        :returns: The response as a string
+        """
+        key = (response, constraint)
+        # Modifications replace the cache, so a response rendered while the
+        # dataset is modified is never stored in the new one
+        responses = self._responses
+        try:
+            return responses[key]
+        except KeyError:
+            pass
+
+        render = getattr(super(Dataset, self), response)
+        text = ''.join(render(constraint=constraint))
+        if len(responses) >= Config.RESPONSE_CACHE_SIZE:
+            responses.clear()
+        responses[key] = text
+        return text
+
+    def _reset_children_cache(self):
+        super(Dataset, self)._reset_children_cache()
+        self._responses = {}
+
     def dods_data(self, constraint=''):
 
         yield b'Data:\r\n'
 
         for obj in self.children:
-            for stmt in obj.dods_data(constraint=constraint):
-                yield stmt
+            yield from obj.dods_data(constraint=constraint)
 
 
 class Sequence(DAPObject):
@@ -301,8 +446,8 @@ class Sequence(DAPObject):
     end_of_seq = b'\xa5\x00\x00\x00'
 
     def __init__(self, *args, **kwargs):
-        super(Sequence, self).__init__(*args, **kwargs)
         self.schema = None
+        super(Sequence, self).__init__(*args, **kwargs)
 
     def append(self, *item):
 
@@ -316,31 +461,32 @@ class Sequence(DAPObject):
     def add_schema(self, schema):
         schema.parent = self
         self.schema = schema
+        self._children_changed()
+
+    def _reset_cache(self):
+        super(Sequence, self)._reset_cache()
+        if self.schema is not None:
+            self.schema._reset_cache()
 
     def das(self, constraint=''):
         if meets_constraint(constraint, self.data_path):
             yield self.dashead()
             for item in self.schema.children:
-                item.parent = self
-                for stmt in item.das(constraint=constraint):
-                    yield stmt
+                yield from item.das(constraint=constraint)
             yield self.dastail()
 
     def dds(self, constraint=''):
         if meets_constraint(constraint, self.data_path):
             yield self.ddshead()
             for item in self.schema.children:
-                item.parent = self
-                for stmt in item.dds(constraint=constraint):
-                    yield stmt
+                yield from item.dds(constraint=constraint)
             yield self.ddstail()
 
     def dods_data(self, constraint=''):
         if meets_constraint(constraint, self.data_path):
             for obj in self.children:
                 yield self.start_of_inst
-                for stmt in obj.dods_data(constraint=constraint):
-                    yield stmt
+                yield from obj.dods_data(constraint=constraint)
             yield self.end_of_seq
         return
 
@@ -362,21 +508,76 @@ class SequenceInstance(DAPObject):
 
     def dods_data(self, constraint=''):
         for obj in self.children:
-            for stmt in obj.dods_data(constraint=constraint):
-                yield stmt
+            yield from obj.dods_data(constraint=constraint)
         return
 
 
 class SequenceSchema(DAPObject):
     """Class holding a schema against which SequenceItems are validated.
     """
-    pass
+    @property
+    def indent(self):
+        return self.parent.indent
+
+    @property
+    def data_path(self):
+        return self.parent.data_path
 
 
 class DAPDataObject(DAPObject):
     """A generic class for typed non-atomic objects holding actual data (i.e.
     Array and Grid).
     """
+    def __init__(self, *args, **kwargs):
+        # Objects that list this one among their dimensions
+        self._dependents = weakref.WeakSet()
+        self._dimensions = None
+        super(DAPDataObject, self).__init__(*args, **kwargs)
+
+    def _reset_cache(self):
+        super(DAPDataObject, self)._reset_cache()
+        # Everything of the DDS declaration up to the dimension lengths
+        self._dds_prefix = None
+
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        # The DDS of the parents depends on the shape of the data
+        self._children_changed()
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @dtype.setter
+    def dtype(self, dtype):
+        self._dtype = dtype
+        self._output_changed()
+
+    @property
+    def dimensions(self):
+        return self._dimensions
+
+    @dimensions.setter
+    def dimensions(self, dimensions):
+        for dim in self._dimensions or ():
+            dim._dependents.discard(self)
+        # Dimensions need not be children of this object, so they notify it
+        # of their changes explicitly
+        for dim in dimensions or ():
+            dim._dependents.add(self)
+        self._dimensions = dimensions
+        self._output_changed()
+
+    def _children_changed(self):
+        super(DAPDataObject, self)._children_changed()
+        for obj in self._dependents:
+            obj._children_changed()
+
     def _parse_args(self, args, kwargs):
 
         self.data = kwargs.get('data', None)
@@ -398,36 +599,38 @@ class DAPDataObject(DAPObject):
 
         if meets_constraint(constraint, self.data_path):
             slices = parse_slice_constraint(constraint)
-            yield from dods_encode(self.data[slices], self.dtype)
+            yield from dods_encode(apply_slices(self.data, slices),
+                                   self.dtype)
             if self.dimensions is not None:
                 for i, dim in enumerate(self.dimensions):
                     sl = slices[i] if i < len(slices) else ...
-                    yield from dods_encode(dim.data[sl], dim.dtype)
+                    yield from dods_encode(apply_slices(dim.data, sl),
+                                           dim.dtype)
 
 
 class Grid(DAPDataObject):
     def dds(self, constraint=''):
         if meets_constraint(constraint, self.data_path):
             slices = parse_slice_constraint(constraint)
-            yield self.ddshead()
-            yield self.indent + '  Array:\n'
-
-            yield self.indent + INDENT + \
-                  '{dtype} {name}'.format(dtype=self.dtype(), name=self.name)
+            if self._dds_prefix is None:
+                self._dds_prefix = f'{self.ddshead()}{self.indent}  Array:\n' \
+                                   f'{self.indent}{INDENT}' \
+                                   f'{self.dtype.__name__} {self.name}'
+            yield self._dds_prefix
             for i, dim in enumerate(self.dimensions):
                 sl = slices[i] if i < len(slices) else ...
-                yield '[{dimname} = {dimlen}]'.format(
-                    dimname=dim.name, dimlen=int(np.prod(dim.data[sl].shape)))
+                yield f'[{dim.name} = {_sliced_length(dim.data.shape, sl)}]'
             yield ';\n'
 
             yield self.indent + '  Maps:\n'
+            # The maps are declared with the indentation of the Grid, the
+            # dimensions keep their own parent since they are usually shared
+            # with the dataset
+            map_indent = self.indent + INDENT
             for i, dim in enumerate(self.dimensions):
-                orig_parent = dim.parent
-                dim.parent = self
                 sl = slices[i] if i < len(slices) else ...
-                for stmt in dim.dds(constraint='', slicing=sl):
-                    yield stmt
-                dim.parent = orig_parent
+                yield f'{dim._dds_declaration(map_indent)}' \
+                      f'{_sliced_length(dim.data.shape, sl)}];\n'
             yield self.ddstail()
 
 
@@ -440,31 +643,53 @@ class Array(DAPDataObject):
             else:
                 slices = slicing
 
-            yield self.indent + \
-                  '{dtype} {name}[{name} = {length}];\n' \
-                      .format(dtype=self.dtype(),
-                              name=self.name,
-                              length=int(np.prod(self.data[slices].shape)))
+            if self._dds_prefix is None:
+                self._dds_prefix = self._dds_declaration(self.indent)
+            length = _sliced_length(self.data.shape, slices)
+            yield f'{self._dds_prefix}{length}];\n'
+
+    def _dds_declaration(self, indent):
+        return f'{indent}{self.dtype.__name__} {self.name}[{self.name} = '
 
 
 class Attribute(DAPObject):
     def __init__(self, value=None, name=None, dtype=None):
-        self.value = value
-        self.dtype = dtype
+        self._value = value
+        self._dtype = dtype
         super(Attribute, self).__init__(name=name)
 
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, value):
+        self._value = value
+        self._output_changed()
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @dtype.setter
+    def dtype(self, dtype):
+        self._dtype = dtype
+        self._output_changed()
+
     def das(self, constraint=''):
-        if self.dtype == String:
-            d = '"'
-        else:
-            d = ''
+        if self._das is None:
+            if self.dtype == String:
+                d = '"'
+            else:
+                d = ''
+            self._das = f'{self.indent}{self.dtype.__name__} {self.name} ' \
+                        f'{d}{self.value}{d};\n'
+
+        yield self._das
 
-        yield '{indent}{dtype} {name} {d}{value}{d};\n' \
-            .format(indent=self.indent,
-                    dtype=self.dtype(),
-                    name=self.name,
-                    value=self.value,
-                    d=d)
+    def _reset_cache(self):
+        super(Attribute, self)._reset_cache()
+        self._das = None
 
     def dds(self, *args, **kwargs):
         yield ''
@@ -477,81 +702,287 @@ def dods_encode(data, dtype):
 
     is_scalar = False
     if not hasattr(data, 'shape'):
-        # if not hasattr(data, '__len__'):
+        # Atomic values carry no length prefix and can be packed directly
+        packer = _ATOM_STRUCTS.get(dtype.str)
+        if packer is not None:
+            try:
+                yield packer.pack(data)
+                return
+            except (struct.error, OverflowError, TypeError):
+                # Leave casting and overflow handling to numpy
+                pass
         data = np.asarray(data)
         is_scalar = True
 
-    length = np.prod(data.shape)
     packed_length = b''
     if not is_scalar:
-        packed_length = length.astype('<i4').byteswap().tobytes() * 2
-
-    yield packed_length
+        packed_length = _length_header(int(data.size))
 
     if isinstance(data, da.Array):
+        yield packed_length
         # Encode in chunks of a defined size if we work with dask.Array
-        chunk_size = int(Config.DASK_ENCODE_CHUNK_SIZE / data.dtype.itemsize)
-        serialize_data = data.ravel().rechunk(chunk_size)
-        for block in serialize_data.blocks:
-            yield block.astype(dtype.str).compute().tobytes()
+        chunk_size = Config.DASK_ENCODE_CHUNK_SIZE // data.dtype.itemsize
+        # Blocks are rechunked (not reshaped) such that concatenating them in
+        # C order yields the raveled array
+        serialize_data = data.rechunk(_ravel_chunks(data.shape, chunk_size))
+        # Encoding is part of the task graph, so it runs on the dask workers
+        encode = dask.delayed(_to_xdr_buffer, pure=True)
+        blocks = [
+            encode(block, dtype)
+            for block in serialize_data.to_delayed().ravel()
+        ]
+        # Compute a few blocks at once, so the scheduler can work on them in
+        # parallel while still bounding the memory footprint.
+        window = Config.DASK_ENCODE_PREFETCH
+        for i in range(0, len(blocks), window):
+            yield from dask.compute(*blocks[i:i + window])
     else:
-        # Make sure we always encode an array or we will get wrong results
         data = np.asarray(data)
-        yield data.astype(dtype.str).tobytes()
+        xdr_dtype = np.dtype(dtype.str)
+        if (data.dtype != xdr_dtype and xdr_dtype.kind in 'iuf'
+                and data.nbytes > Config.NUMPY_ENCODE_CHUNK_SIZE):
+            # Convert large arrays piece by piece instead of allocating a
+            # converted copy of the whole array
+            yield packed_length
+            yield from _to_xdr_pieces(data, xdr_dtype,
+                                      Config.NUMPY_ENCODE_CHUNK_SIZE)
+        else:
+            # Length prefix and data go out as a single bytes object
+            yield _to_xdr_buffer(data, dtype, header=packed_length)
+
+
+@lru_cache(maxsize=1024)
+def _length_header(length):
+    """Return the XDR array header, which holds the array length twice.
+
+    Headers are cached since the same array shapes are served repeatedly.
+
+    :param length: (int) Number of array elements
+    :returns: bytes
+    """
+    return struct.pack('>II', length, length)
+
 
+def _to_xdr_array(data, dtype):
+    """Return array data as a C-contiguous array of the big-endian XDR type.
+
+    Arrays that already have the right type, byte order and layout are
+    returned as they are, without copying.
+
+    :param data: A :class:`numpy.ndarray` or anything convertible to one
+    :param dtype: A subclass of :class:`DAPAtom`
+    :returns: A :class:`numpy.ndarray`
+    """
+    # Casting to the big-endian type swaps the bytes in the same pass
+    return np.require(data, dtype=np.dtype(dtype.str), requirements='C')
+
+
+def _to_xdr_buffer(data, dtype, header=b''):
+    """Convert array data to its big-endian XDR representation.
+
+    :param data: A :class:`numpy.ndarray` or anything convertible to one
+    :param dtype: A subclass of :class:`DAPAtom`
+    :param header: (bytes) Prepended to the encoded data
+    :returns: The encoded data as bytes
+    """
+    # Joining copies header and data into a single new bytes object at once
+    return b''.join((header, _to_xdr_array(data, dtype)))
 
+
+def _to_xdr_pieces(data, xdr_dtype, chunk_size):
+    """Convert array data to its big-endian XDR representation in pieces.
+
+    The array is walked in blocks that are contiguous parts of the raveled
+    array, so sliced views are never flattened into a copy. Every block is
+    cast into the same preallocated output array, so the input is never
+    modified and no temporary of the size of the whole array is needed.
+
+    :param data: A :class:`numpy.ndarray` of a numeric type
+    :param xdr_dtype: The big-endian target :class:`numpy.dtype`
+    :param chunk_size: (int) Maximum size of a piece in Bytes
+    :returns: A generator of bytes
+    """
+    step = max(1, int(chunk_size) // xdr_dtype.itemsize)
+    chunks = _ravel_chunks(data.shape, step)
+    out = np.empty(min(step, data.size), dtype=xdr_dtype)
+    starts = [range(0, n, c) for n, c in zip(data.shape, chunks)]
+    for start in itertools.product(*starts):
+        block = data[tuple(
+            slice(i, i + c) for i, c in zip(start, chunks))]
+        buf = out[:block.size]
+        np.copyto(buf.reshape(block.shape), block, casting='unsafe')
+        yield buf.tobytes()
+
+
+def _ravel_chunks(shape, chunk_size):
+    """Compute the chunks of an array such that its blocks, taken in C order,
+    are contiguous parts of the raveled array.
+
+    Trailing axes are kept whole as long as a block stays within
+    ``chunk_size`` elements, the next axis is split and all leading axes are
+    chunked by one.
+
+    :param shape: Shape of the array
+    :param chunk_size: (int) Maximum number of elements per block
+    :returns: A tuple of chunk sizes, one per axis
+    """
+    chunks = list(shape)
+    block_size = 1
+    for axis in reversed(range(len(shape))):
+        if block_size * shape[axis] > chunk_size:
+            chunks[axis] = max(1, chunk_size // block_size)
+            chunks[:axis] = [1] * axis
+            break
+        block_size *= shape[axis]
+    return tuple(chunks)
+
+
+@lru_cache(maxsize=256)
 def parse_slice_constraint(constraint):
     """Parses the slicing part of a constraint expression.
 
+    Results are cached, since every array of a dataset parses the same
+    constraint.
+
     :param constraint: A complete constraint string as received through DAP
                        request.
     :returns: A tuple of slices that can be used for accessing a subdomain of a
               dataset.
     """
-    slice_split = re.split(SLICE_CONSTRAINT_RE, constraint)
-    if len(slice_split) == 3:
-        slice_str = slice_split[1].replace('][', ',')
-        return tuple(parse_slice(s) for s in slice_str.split(','))
-    else:
+    if '[' not in constraint:
         return ...,
 
+    match = _SLICE_RE.search(constraint)
+    if match is None:
+        return ...,
+
+    slice_str = match.group(1).replace('][', ',')
+    return tuple(parse_slice(s) for s in slice_str.split(','))
+
 
 def parse_slice(token):
     """Parse a single slice string
 
-    :param token: A string containing a number [3], a range [3:7] or a colon [:]
+    :param token: A string containing a number [3], a range [3:7], a strided
+                  range [3:2:7] or a colon [:]
     :returns: An integer for simple numbers, or a slice object
     """
-    try:
-        return int(token)
-    except ValueError:
-        if token == ':':
-            return ...
-        elif ':' in token:
-            rng = [int(s) for s in token.split(':')]
-            # The DAP protocol uses slicing including the last index.
-            # [0:20] in DAP translates to [0:21] in Python.
-            rng[1] += 1
-            return slice(*rng)
+    start, sep, stop = token.partition(':')
+    if not sep:
+        return int(start)
+    elif not start and not stop:
+        return ...
+
+    stride = None
+    if ':' in stop:
+        # DAP strides are given as [start:stride:stop]
+        stride, _, stop = stop.partition(':')
+        stride = int(stride)
+
+    # The DAP protocol uses slicing including the last index.
+    # [0:20] in DAP translates to [0:21] in Python.
+    return slice(int(start), int(stop) + 1, stride)
+
+
+def apply_slices(data, slices):
+    """Select a subdomain of an array.
+
+    Each Ellipsis stands for a single complete axis and is replaced by
+    ``slice(None)`` before indexing. Unsliced data is returned as it is,
+    without indexing it at all.
+
+    :param data: A :class:`numpy.ndarray` or :class:`dask.array.Array`
+    :param slices: A tuple of slices as returned by
+                   :func:`parse_slice_constraint`, or a single slice token
+    :returns: The sliced array
+    """
+    if not isinstance(slices, tuple):
+        slices = (slices, )
+    index = tuple(slice(None) if sl is Ellipsis else sl for sl in slices)
+    if all(sl == slice(None) for sl in index):
+        return data
+    return data[index]
+
+
+def _slice_len(sl, dim_len):
+    """Return the length of a dimension after applying a single slice token.
+
+    :param sl: An integer, a slice object or Ellipsis as returned by
+               :func:`parse_slice`
+    :param dim_len: Length of the unsliced dimension
+    :returns: An integer
+    :raises IndexError: If an integer index is out of bounds, as indexing
+                        the data would
+    """
+    if sl is Ellipsis:
+        return dim_len
+    elif isinstance(sl, slice):
+        return len(range(*sl.indices(dim_len)))
+    elif not -dim_len <= sl < dim_len:
+        raise IndexError(f'index {sl} is out of bounds for axis with size '
+                         f'{dim_len}')
+    else:
+        return 1
+
+
+def _sliced_length(shape, slices):
+    """Compute the number of elements of an array after slicing, without
+    actually slicing the array.
+
+    :param shape: Shape of the unsliced array
+    :param slices: A tuple of slices as returned by
+                   :func:`parse_slice_constraint`, or a single slice token
+    :returns: An integer
+    """
+    if not isinstance(slices, tuple):
+        slices = (slices, )
+    length = 1
+    for i, dim_len in enumerate(shape):
+        sl = slices[i] if i < len(slices) else ...
+        length *= _slice_len(sl, dim_len)
+    return length
+
+
+@lru_cache(maxsize=256)
+def parse_constraint(constraint_expr):
+    """Parse the projection part of a constraint expression into a set of
+    data paths.
+
+    Selection clauses and slicing suffixes are dropped and every dotted prefix
+    of a projected variable (``a``, ``a.b`` and ``a.b.c`` for ``a.b.c``) is
+    added to the set, such that matching a data path becomes a single lookup.
+    Results are cached, since the same constraint is checked against every
+    object of a dataset.
+
+    :param constraint_expr: (string) A DAP constraint string
+    :returns: A frozenset of strings
+    """
+    # Selection clauses (everything from the first '&') do not project
+    projection = constraint_expr.split('&', 1)[0]
+    prefixes = {''}
+    for constr in projection.split(','):
+        path = constr.split('[', 1)[0].strip()
+        parts = path.split('.')
+        prefixes.update('.'.join(parts[:i]) for i in range(1, len(parts) + 1))
+    return frozenset(prefixes)
 
 
 def meets_constraint(constraint_expr, data_path):
     """Parse the constraint expression and check if data_path meets the
     criteria.
 
-    :param constraint_expr: (string) A DAP constraint string
+    :param constraint_expr: (string) A DAP constraint string, or a set of
+                            paths as returned by :func:`parse_constraint`
     :param data_path: (string) Path of a DAP object within the dataset
     :returns: a boolean
     """
-    if constraint_expr == '':
+    if not constraint_expr:
         return True
 
-    constraint = constraint_expr.split(',')
-    for constr in constraint:
-        if constr.startswith(data_path):
-            return True
+    if isinstance(constraint_expr, str):
+        constraint_expr = parse_constraint(constraint_expr)
 
-    return False
+    return data_path in constraint_expr
 
 
 def set_dask_encoding_chunk_size(chunk_size: int):
@@ -560,8 +991,22 @@ def set_dask_encoding_chunk_size(chunk_size: int):
     :param chunk_size: (int) Encoding chunk size in Bytes
     :returns: None
     """
-    chunk_size = int(chunk_size)
-    if chunk_size > 0: 
-        Config.DASK_ENCODE_CHUNK_SIZE = chunk_size
-    else:
-        raise ValueError('Encoding chunk size needs to be greather than 0.')
+    Config.DASK_ENCODE_CHUNK_SIZE = _validate_chunk_size(chunk_size)
+
+
+def set_numpy_encoding_chunk_size(chunk_size: int):
+    """Set the size above which ``numpy.ndarray``s are converted to XDR in
+    pieces of at most this size.
+
+    :param chunk_size: (int) Encoding chunk size in Bytes
+    :returns: None
+    """
+    Config.NUMPY_ENCODE_CHUNK_SIZE = _validate_chunk_size(chunk_size)
+
+
+def _validate_chunk_size(chunk_size):
+    # Accepts Python and numpy integers, raises TypeError for anything else
+    chunk_size = operator.index(chunk_size)
+    if chunk_size <= 0:
+        raise ValueError('Encoding chunk size needs to be greater than 0.')
+    return chunk_size
@@ -26,16 +26,15 @@
 # OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import xdrlib
-from functools import reduce
+import struct
 
 import dask.array as da
 import numpy as np
 import opendap_protocol as dap
 import pytest
-from opendap_protocol.protocol import dods_encode
-
-XDRPACKER = xdrlib.Packer()
+from opendap_protocol.protocol import (_length_header, _ravel_chunks,
+                                       _sliced_length, _to_xdr_array,
+                                       dods_encode)
 
 
 def test_dods_encode():
@@ -47,6 +46,12 @@ def test_dods_encode():
     assert xdrpacked == b''.join(dap.dods_encode(testdata, dap.Float32))
 
     assert b'\x00\x00\x00\x00' == b''.join(dap.dods_encode(0, dap.Float32))
+    assert b'\x00\x00\x00\x07' == b''.join(dap.dods_encode(7, dap.Int32))
+    assert b'\xff\xff\xff\xff' == b''.join(dap.dods_encode(-1, dap.UInt32))
+    # Values out of the Float32 range overflow to inf, as numpy casts them
+    with np.errstate(over='ignore'):
+        assert b'\x7f\x80\x00\x00' == b''.join(
+            dap.dods_encode(1e40, dap.Float32))
 
     arrdata = np.asarray([1, 2, 3])
     assert b''.join(dap.dods_encode(
@@ -72,16 +77,49 @@ def test_dods_encode():
     y = dap.dods_encode(np_data, dap.Int32)
     assert b''.join(x) == b''.join(y)
 
+    # encode the dask array in several blocks
+    chunk_size = dap.Config.DASK_ENCODE_CHUNK_SIZE
+    dap.set_dask_encoding_chunk_size(400000)
+    try:
+        x = dap.dods_encode(data_vals, dap.Int32)
+        y = dap.dods_encode(np_data, dap.Int32)
+        assert b''.join(x) == b''.join(y)
+    finally:
+        dap.set_dask_encoding_chunk_size(chunk_size)
+
     int_arrdata = np.arange(0, 20, 2, dtype='<i4')
     assert b''.join(dods_encode(int_arrdata,
                                 dap.Int32)) == pack_xdr_int_array(int_arrdata)
 
+    be_arrdata = np.arange(0, 20, 2, dtype='>i4')
+    assert b''.join(dods_encode(be_arrdata,
+                                dap.Int32)) == pack_xdr_int_array(int_arrdata)
+
+    f_arrdata = np.asfortranarray(np.arange(12, dtype='<i8').reshape(3, 4))
+    assert b''.join(dods_encode(f_arrdata, dap.Int32)) == \
+        pack_xdr_int_array(f_arrdata.ravel())
+
+    # convert a numpy array in several pieces
+    chunk_size = dap.Config.NUMPY_ENCODE_CHUNK_SIZE
+    dap.set_numpy_encoding_chunk_size(12)
+    try:
+        assert b''.join(dods_encode(f_arrdata, dap.Int32)) == \
+            pack_xdr_int_array(f_arrdata.ravel())
+        assert b''.join(dods_encode(arrdata, dap.Float64)) == \
+            pack_xdr_double_array(arrdata)
+        sliced = np.arange(210, dtype='<i8').reshape(5, 6, 7)[:, 1:5, ::2]
+        assert b''.join(dods_encode(sliced, dap.Int32)) == \
+            pack_xdr_int_array(sliced.ravel())
+    finally:
+        dap.set_numpy_encoding_chunk_size(chunk_size)
+
 
 def test_parse_slice():
 
     assert dap.parse_slice(':') == Ellipsis
     assert dap.parse_slice('3:7') == slice(3, 8)
     assert dap.parse_slice('4') == 4
+    assert dap.parse_slice('2:3:11') == slice(2, 12, 3)
 
 
 def test_parse_slice_constraint():
@@ -95,6 +133,63 @@ def test_parse_slice_constraint():
     assert dap.parse_slice_constraint('[]') == (Ellipsis, )
 
 
+@pytest.mark.parametrize('array', [np.arange, da.arange],
+                         ids=['numpy.array', 'dask.array'])
+def test_apply_slices(array):
+
+    data = array(60).reshape((3, 4, 5))
+    assert dap.apply_slices(data, (Ellipsis, )) is data
+    assert dap.apply_slices(data, (Ellipsis, Ellipsis, Ellipsis)) is data
+    assert dap.apply_slices(data, (0, Ellipsis, Ellipsis)).shape == (4, 5)
+    assert dap.apply_slices(data, (Ellipsis, slice(1, 3), 2)).shape == (3, 2)
+    assert dap.apply_slices(data, 1).shape == (4, 5)
+
+
+def test_sliced_length():
+
+    assert _sliced_length((10, ), (Ellipsis, )) == 10
+    assert _sliced_length((10, ), 3) == 1
+    assert _sliced_length((10, ), -10) == 1
+    with pytest.raises(IndexError):
+        _sliced_length((10, ), 10)
+    with pytest.raises(IndexError):
+        _sliced_length((10, ), -11)
+    assert _sliced_length((10, ), slice(3, 8)) == 5
+    assert _sliced_length((10, ), slice(8, 20)) == 2
+    assert _sliced_length((4, 5, 6), (0, Ellipsis, slice(1, 3))) == 10
+    assert _sliced_length((4, 5, 6), (slice(1, 3), )) == 60
+
+
+def test_length_header():
+
+    assert _length_header(3) == b'\x00\x00\x00\x03\x00\x00\x00\x03'
+    assert _length_header(70000) == b'\x00\x01\x11\x70' * 2
+    assert _length_header(3) is _length_header(3)
+
+
+def test_to_xdr_array():
+
+    be_arrdata = np.arange(10, dtype='>i4')
+    assert np.shares_memory(_to_xdr_array(be_arrdata, dap.Int32), be_arrdata)
+
+    le_arrdata = np.arange(10, dtype='<i4')
+    xdr_arrdata = _to_xdr_array(le_arrdata, dap.Int32)
+    assert xdr_arrdata.dtype == np.dtype('>i4')
+    assert np.array_equal(xdr_arrdata, le_arrdata)
+
+    f_arrdata = np.asfortranarray(np.arange(12, dtype='>i4').reshape(3, 4))
+    assert _to_xdr_array(f_arrdata, dap.Int32).flags.c_contiguous
+
+
+def test_ravel_chunks():
+
+    assert _ravel_chunks((4, 5, 6), 1000) == (4, 5, 6)
+    assert _ravel_chunks((4, 5, 6), 60) == (2, 5, 6)
+    assert _ravel_chunks((4, 5, 6), 20) == (1, 3, 6)
+    assert _ravel_chunks((4, 5, 6), 4) == (1, 1, 4)
+    assert _ravel_chunks((), 4) == ()
+
+
 def test_meets_constraint():
 
     assert dap.meets_constraint('', 'test.object.path')
@@ -102,6 +197,19 @@ def test_meets_constraint():
     assert dap.meets_constraint('test.object.path', 'test')
     assert dap.meets_constraint('test.object.path', 'test.object')
     assert dap.meets_constraint('test.object.path', 'test1.object') is False
+    assert dap.meets_constraint('test1.object', 'test') is False
+    assert dap.meets_constraint('test.object.path', 'test.obj') is False
+
+    assert dap.meets_constraint('x,test.object[0][1:2]', 'test.object')
+    assert dap.meets_constraint('x,test.object[0][1:2]', 'x')
+    assert dap.meets_constraint('x,test.object[0][1:2]', 'y') is False
+
+    assert dap.meets_constraint('st.a&st.a>1', 'st.a')
+    assert dap.meets_constraint('st.a&st.b>1', 'st.b') is False
+
+    parsed = dap.parse_constraint('test.object.path[0]')
+    assert dap.meets_constraint(parsed, 'test.object')
+    assert dap.meets_constraint(parsed, 'test1.object') is False
 
 
 def test_DAPObject():
@@ -134,6 +242,16 @@ def test_Dataset():
     assert ob1.data_path == 'Object_1'
     assert ob1.indent == '    '
 
+    ob2 = dap.DAPObject(name='Object 2')
+    ob1.append(ob2)
+    assert ob2.data_path == 'Object_1.Object_2'
+
+    structure = dap.Structure(name='Structure')
+    dataset.append(structure)
+    structure.append(ob1)
+    assert ob1.data_path == 'Structure.Object_1'
+    assert ob2.data_path == 'Structure.Object_1.Object_2'
+
 
 def test_Attribute():
 
@@ -154,9 +272,34 @@ def test_Attribute():
 
     assert 'Attribute' not in ''.join(dataset.dds())
 
+    structure = dap.Structure(name='Structure')
+    dataset.append(structure)
+    structure.append(attr1)
+    assert ''.join(attr1.das()) == '        Float32 Attribute_1 3;\n'
+
 
 def test_DAPAtom():
-    pass
+
+    assert dap.DAPAtom.type_from_np(np.int8) == dap.Int16
+    assert dap.DAPAtom.type_from_np(np.uint8) == dap.Byte
+    assert dap.DAPAtom.type_from_np(np.int64) == dap.Int32
+    assert dap.DAPAtom.type_from_np(np.float32) == dap.Float32
+    assert dap.DAPAtom.type_from_np(np.dtype('float64')) == dap.Float64
+    assert dap.DAPAtom.type_from_np(np.complex64) is None
+    assert dap.DAPAtom.type_from_np(None) is None
+    assert dap.DAPAtom.type_from_np('foo') is None
+
+    dataset = dap.Dataset(name='test')
+    string = dap.String('a string', name='string')
+    dataset.append(string)
+    assert b''.join(string.dods_data()) == b'a string'
+
+    # Non-ASCII values only fail when the data is encoded
+    string = dap.String('\u00e9', name='accent')
+    dataset.append(string)
+    assert 'String accent;' in ''.join(dataset.dds())
+    with pytest.raises(UnicodeEncodeError):
+        b''.join(string.dods_data())
 
 
 test_arrays = [
@@ -223,9 +366,91 @@ def test_complete_dap_response(x, y, z):
     assert ''.join(dataset.dds()) == expected_dds
     assert b''.join(
         dataset.dods()) == expected_dds.encode() + expected_dods_data
+    assert dataset.dods_bytes() == expected_dds.encode() + expected_dods_data
+    # WSGI servers require every item of a streamed response to be bytes
+    assert all(type(item) is bytes for item in dataset.dods())
 
     assert x_dap.parent == dataset
     assert y_dap.parent == dataset
+    assert x_dap.data_path == 'x'
+    assert y_dap.data_path == 'y'
+
+    # Modifications invalidate the cached output
+    x_dap.data = x[:1]
+    assert 'Int16 x[x = 1];' in ''.join(dataset.dds())
+    dataset.append(dap.Attribute(name='title', value='t', dtype=dap.String))
+    assert 'String title "t";' in ''.join(dataset.das())
+
+
+def test_modified_dap_response():
+
+    dataset = dap.Dataset(name='test')
+    x_dap = dap.Array(name='x', data=np.array([0, 1, 2]), dtype=dap.Int16)
+    y_dap = dap.Array(name='y', data=np.array([0, 1]), dtype=dap.Int16)
+    g_dap = dap.Grid(name='g',
+                     data=np.zeros((3, 2)),
+                     dtype=dap.Int32,
+                     dimensions=[x_dap, y_dap])
+    attr = dap.Attribute(name='units', value='m', dtype=dap.String)
+    g_dap.append(attr)
+    dataset.append(x_dap, y_dap, g_dap)
+
+    assert '} g;' in ''.join(dataset.dds())
+    assert 'String units "m";' in ''.join(dataset.das())
+
+    g_dap.name = 'h'
+    assert '} h;' in ''.join(dataset.dds())
+    assert '    h {\n' in ''.join(dataset.das())
+
+    g_dap.dtype = dap.Float64
+    assert 'Float64 h[x = 3][y = 2];' in ''.join(dataset.dds())
+
+    g_dap.dimensions = [y_dap, x_dap]
+    assert 'Float64 h[y = 2][x = 3];' in ''.join(dataset.dds())
+
+    x_dap.dtype = dap.Int32
+    assert '    Int32 x[x = 3];\n' in ''.join(dataset.dds())
+
+    attr.value = 'km'
+    assert 'String units "km";' in ''.join(dataset.das())
+
+    attr.value = 3
+    attr.dtype = dap.Float64
+    assert 'Float64 units 3;' in ''.join(dataset.das())
+
+    # Dimensions that are not part of the dataset invalidate the Grid as well
+    t_dap = dap.Array(name='t', data=np.arange(3), dtype=dap.Int16)
+    g_dap.dimensions = [t_dap]
+    assert 'Int16 t[t = 3];' in ''.join(dataset.dds())
+    t_dap.data = np.array([0, 1])
+    assert 'Int16 t[t = 2];' in ''.join(dataset.dds())
+
+
+def test_interleaved_dds():
+
+    dataset = dap.Dataset(name='test')
+    x_dap = dap.Array(name='x', data=np.array([0, 1]), dtype=dap.Int16)
+    g_dap = dap.Grid(name='g',
+                     data=np.zeros(2),
+                     dtype=dap.Int32,
+                     dimensions=[x_dap])
+    dataset.append(x_dap, g_dap)
+    expected_dds = ''.join(dataset.dds())
+
+    # Render the dataset while the Grid is suspended within its maps
+    grid_dds = g_dap.dds()
+    for part in grid_dds:
+        if 'Maps' in part:
+            break
+    next(grid_dds)
+    dataset.append(dap.Attribute(name='title', value='t', dtype=dap.String))
+    assert ''.join(dataset.dds()) == expected_dds
+    assert 'Int16 x[x = 2];' in ''.join(dataset.dds(constraint='x'))
+    list(grid_dds)
+
+    assert x_dap.parent is dataset
+    assert ''.join(dataset.dds()) == expected_dds
+    assert 'Int16 x[x = 2];' in ''.join(dataset.dds(constraint='x'))
 
 
 @pytest.mark.parametrize('x,y,z',
@@ -278,6 +503,8 @@ def test_sliced_dap_response(x, y, z):
 
     assert ''.join(dataset.das(constraint='z.z[0][0]')) == expected_das
     assert ''.join(dataset.dds(constraint='z.z[0][0]')) == expected_dds
+    # Served from the response cache
+    assert ''.join(dataset.dds(constraint='z.z[0][0]')) == expected_dds
     assert b''.join(dataset.dods(
         constraint='z.z[0][0]')) == expected_dds.encode() + expected_dods_data
 
@@ -294,33 +521,60 @@ def test_set_dask_encoding_chunk_size():
 
     # Restore the default value
     reload(opendap_protocol.protocol)
-    assert opendap_protocol.protocol.Config.DASK_ENCODE_CHUNK_SIZE == 20e6
+    assert opendap_protocol.protocol.Config.DASK_ENCODE_CHUNK_SIZE == 20_000_000
+
+    # The default is accepted by the setter
+    set_dask_encoding_chunk_size(
+        opendap_protocol.protocol.Config.DASK_ENCODE_CHUNK_SIZE)
 
     invalid_values = [ 0, -10, [], 'cloud', '', {}, ]
     for val in invalid_values:
         with pytest.raises((TypeError, ValueError)):
             set_dask_encoding_chunk_size(val)
 
+    for val in [0, -10]:
+        with pytest.raises(ValueError):
+            set_dask_encoding_chunk_size(val)
+
+    for val in [[], 'cloud', '', {}, '123', 1.5]:
+        with pytest.raises(TypeError):
+            set_dask_encoding_chunk_size(val)
+
+
+def test_set_numpy_encoding_chunk_size():
+    # Look up Config through the module, which other tests reload
+    chunk_size = dap.protocol.Config.NUMPY_ENCODE_CHUNK_SIZE
+    dap.set_numpy_encoding_chunk_size(np.int64(123))
+    try:
+        assert dap.protocol.Config.NUMPY_ENCODE_CHUNK_SIZE == 123
+    finally:
+        dap.set_numpy_encoding_chunk_size(chunk_size)
+
+    for val in [0, -10]:
+        with pytest.raises(ValueError):
+            dap.set_numpy_encoding_chunk_size(val)
+
+    for val in [[], 'cloud', '123', 1.5]:
+        with pytest.raises(TypeError):
+            dap.set_numpy_encoding_chunk_size(val)
+
 
 def pack_xdr_float(data):
-    XDRPACKER.reset()
-    XDRPACKER.pack_int(np.asarray(len(data)).astype('<i4'))
-    XDRPACKER.pack_int(np.asarray(len(data)).astype('<i4'))
-    XDRPACKER.pack_farray(len(data), data, XDRPACKER.pack_float)
-    return XDRPACKER.get_buffer()
+    return pack_xdr_array(np.asarray(data, dtype='<f4'), 'f')
 
 
 def pack_xdr_double_array(data):
-    XDRPACKER.reset()
-    XDRPACKER.pack_int(np.asarray(len(data)))
-    XDRPACKER.pack_int(np.asarray(len(data)))
-    XDRPACKER.pack_farray(len(data), data.astype('<f8'), XDRPACKER.pack_double)
-    return XDRPACKER.get_buffer()
+    return pack_xdr_array(np.asarray(data).astype('<f8'), 'd')
 
 
 def pack_xdr_int_array(data):
-    XDRPACKER.reset()
-    XDRPACKER.pack_int(np.asarray(len(data)))
-    XDRPACKER.pack_int(np.asarray(len(data)))
-    XDRPACKER.pack_farray(len(data), data.astype('<i4'), XDRPACKER.pack_int)
-    return XDRPACKER.get_buffer()
+    return pack_xdr_array(np.asarray(data).astype('<i4'), 'i')
+
+
+def pack_xdr_array(data, fmt):
+    """Pack a 1D array as XDR array with the given struct format character,
+    independently of the numpy based encoding under test.
+    """
+    length = len(data)
+    return struct.pack('>II{:d}{}'.format(length, fmt), length, length,
+                       *data.tolist())